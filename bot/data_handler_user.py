@@ -7,6 +7,7 @@ import json
 import os
 import sys
 import asyncio
+import threading
 import aiohttp
 import requests
 from datetime import datetime
@@ -23,6 +24,8 @@ class UserDataHandler:
     def __init__(self, csv_file=None, media_dir=None):
         self.csv_file = csv_file or CSV_FILE
         self.media_dir = media_dir or MEDIA_DIR
+        # 序列化 CSV 寫入（save_message 在執行緒池中執行）
+        self._write_lock = threading.Lock()
         self._init_csv()
         self._ensure_media_dir()
 
@@ -60,48 +63,60 @@ class UserDataHandler:
         return filename.strip()
 
     async def save_message(self, message):
-        """儲存單條訊息"""
-        try:
-            # 獲取附件資訊
-            attachments_data = []
-            for attachment in message.attachments:
-                attachment_info = {
-                    'id': attachment.id,
-                    'filename': attachment.filename,
-                    'url': attachment.url,
-                    'size': attachment.size,
-                    'content_type': attachment.content_type,
-                    'height': attachment.height,
-                    'width': attachment.width
-                }
-                attachments_data.append(attachment_info)
-
-            # 獲取作者頭像 URL
-            author_avatar = str(message.author.avatar.url) if message.author.avatar else None
-
-            # 準備數據
-            data = [
-                str(message.channel.id),
-                message.channel.name,
-                str(message.id),
-                message.author.name,
-                str(message.author.id),
-                author_avatar,
-                message.content or '',
-                message.created_at.isoformat(),
-                message.edited_at.isoformat() if message.edited_at else '',
-                json.dumps(attachments_data, ensure_ascii=False),
-                len(message.embeds),
-                str(message.type),
-                json.dumps([m['username'] for m in message.mentions] if isinstance(message.mentions, list) else []),
-                message.jump_url
-            ]
-
-            # 寫入 CSV
+        """儲存單條訊息（在執行緒中寫入檔案，避免阻塞事件循環）"""
+        await asyncio.to_thread(self._save_message_sync, message)
+
+    async def save_messages_bulk(self, messages):
+        """批量儲存訊息 - 只開啟一次檔案寫入全部資料列"""
+        await asyncio.to_thread(self._save_messages_bulk_sync, messages)
+
+    def _build_row(self, message):
+        """將訊息轉換為 CSV 資料列"""
+        # 獲取附件資訊
+        attachments_data = []
+        for attachment in message.attachments:
+            attachment_info = {
+                'id': attachment.id,
+                'filename': attachment.filename,
+                'url': attachment.url,
+                'size': attachment.size,
+                'content_type': attachment.content_type,
+                'height': attachment.height,
+                'width': attachment.width
+            }
+            attachments_data.append(attachment_info)
+
+        # 獲取作者頭像 URL
+        author_avatar = str(message.author.avatar.url) if message.author.avatar else None
+
+        return [
+            str(message.channel.id),
+            message.channel.name,
+            str(message.id),
+            message.author.name,
+            str(message.author.id),
+            author_avatar,
+            message.content or '',
+            message.created_at.isoformat(),
+            message.edited_at.isoformat() if message.edited_at else '',
+            json.dumps(attachments_data, ensure_ascii=False),
+            len(message.embeds),
+            str(message.type),
+            json.dumps([m['username'] for m in message.mentions] if isinstance(message.mentions, list) else []),
+            message.jump_url
+        ]
+
+    def _append_rows(self, rows):
+        """寫入 CSV"""
+        with self._write_lock:
             with open(self.csv_file, 'a', newline='', encoding='utf-8-sig') as f:
                 writer = csv.writer(f)
-                writer.writerow(data)
+                writer.writerows(rows)
 
+    def _save_message_sync(self, message):
+        """儲存單條訊息（同步版本）"""
+        try:
+            self._append_rows([self._build_row(message)])
             print(f"已儲存訊息: {message.id} from {message.channel.name}")
 
         except Exception as e:
@@ -109,6 +124,26 @@ class UserDataHandler:
             import traceback
             traceback.print_exc()
 
+    def _save_messages_bulk_sync(self, messages):
+        """批量儲存訊息（同步版本）"""
+        rows = []
+        for message in messages:
+            # 單條訊息轉換失敗時略過，不影響同批其他訊息
+            try:
+                rows.append(self._build_row(message))
+            except Exception as e:
+                print(f"轉換訊息失敗，已略過 {getattr(message, 'id', '?')}: {e}")
+
+        try:
+            if rows:
+                self._append_rows(rows)
+                print(f"已批量儲存 {len(rows)} 條訊息")
+
+        except Exception as e:
+            print(f"批量儲存訊息失敗: {e}")
+            import traceback
+            traceback.print_exc()
+
     def get_all_messages(self):
         """讀取所有訊息"""
         messages = []
@@ -5,11 +5,20 @@
 """
 
 import re
-import json
 import os
+import stat
+import threading
+import time
+import atexit
+import bisect
+import tempfile
+import traceback
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Iterable, Iterator, Tuple, Callable
 from enum import Enum
+from operator import attrgetter
+
+import orjson
 
 # 澳門時區 (UTC+8)
 MACAU_TZ = timezone(timedelta(hours=8))
@@ -17,6 +26,21 @@ MACAU_TZ = timezone(timedelta(hours=8))
 # 美國東部時區 (ET)
 US_EASTERN_TZ = timezone(timedelta(hours=-5))  # EST, 或使用 -4 (EDT) 自動處理夏令時
 
+# 括號內備註的解析規則 (預先編譯；呼叫前先以字面字串過濾，避免無謂的正則匹配)
+_CLOSE_RE = re.compile(r'all out\s*@?\$?([\d.]+)', re.IGNORECASE)   # all out @.81
+_JPM_PNL_RE = re.compile(r'\(([+-]?\d+)\s*%?\)')                    # (+15%) 或 (+15)
+_EMBED_PNL_RE = re.compile(r'\(([+\-]?\d+)%\)')                      # (+15%)
+_NOTES_PNL_RE = re.compile(r'([+-]?\d+)\s*%')                         # +15%
+
+
+def _compact_timestamp(dt: datetime) -> str:
+    """格式化為 YYYYMMDDHHMMSS (用於訂單ID，比 strftime 快)"""
+    return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
+
+
+# 訊息排序鍵 (時間戳字串；寫入時保證不為 None)
+_message_sort_key = attrgetter('timestamp')
+
 
 class OrderStatus(Enum):
     PENDING = "pending"    # 待執行
@@ -28,6 +52,12 @@ class OrderStatus(Enum):
 class TradeOrder:
     """交易訂單類 - 追蹤每筆獨立訂單"""
     
+    __slots__ = (
+        'order_id', 'ticker', 'option_type', 'strike_price', 'expiration',
+        'entry_price', 'entry_time', 'exit_price', 'exit_time', 'pnl_percent',
+        'status', 'messages', 'notes'
+    )
+    
     def __init__(self):
         self.order_id: str = ""           # 訂單唯一ID
         self.ticker: str = ""              # 股票代碼 (QQQ, SPY)
@@ -64,6 +94,8 @@ class TradeOrder:
 class ChannelMessage:
     """頻道訊息記錄 - 記錄每一條訊息"""
     
+    __slots__ = ('id', 'channel_id', 'content', 'timestamp', 'has_order', 'order_id')
+    
     def __init__(self):
         self.id: str = ""
         self.channel_id: str = ""
@@ -86,6 +118,19 @@ class ChannelMessage:
 class TradingTracker:
     """期權交易追蹤器 - 簡化版"""
     
+    # 存檔延遲 (秒)：期間內的多次變更合併為一次寫入
+    SAVE_DELAY = 2.0
+    
+    # 過期檢查最短間隔 (秒)：到期以日為單位，無需每次查詢都掃描
+    EXPIRY_CHECK_INTERVAL = 60.0
+    
+    # 由數據文件重建的狀態 (重新載入時整體替換)
+    _STATE_ATTRS = (
+        'orders', 'all_messages', 'open_positions', '_closed_orders', '_expired_orders',
+        '_wins', '_losses', '_orders_by_ticker', '_messages_by_channel',
+        '_messages_with_order', '_messages_without_order', '_open_view_cache', '_closed_json'
+    )
+    
     def __init__(self, data_file: str = None):
         # 初始化數據文件路徑
         if data_file is None:
@@ -99,12 +144,48 @@ class TradingTracker:
         # 訂單列表
         self.orders: Dict[str, TradeOrder] = {}
         
-        # 所有訊息列表
+        # 所有訊息列表 (按時間戳升序保存，查詢時倒序輸出)
         self.all_messages: List[ChannelMessage] = []
         
         # 活躍持倉 (用於匹配平倉訂單)
         self.open_positions: Dict[str, TradeOrder] = {}
         
+        # 已平倉 / 已過期訂單 (按狀態分區，查詢時不必掃描全部訂單)
+        self._closed_orders: Dict[str, TradeOrder] = {}
+        self._expired_orders: Dict[str, TradeOrder] = {}
+        
+        # 已平倉訂單的盈虧計數 (平倉時累加，統計時不必掃描)
+        self._wins = 0
+        self._losses = 0
+        
+        # 查詢索引：股票代碼 -> 訂單、頻道 -> 訊息、是否含訂單 -> 訊息
+        self._orders_by_ticker: Dict[str, Dict[str, TradeOrder]] = {}
+        self._messages_by_channel: Dict[str, List[ChannelMessage]] = {}
+        self._messages_with_order: List[ChannelMessage] = []
+        self._messages_without_order: List[ChannelMessage] = []
+        
+        # 存檔防抖：變更時只做標記，由背景執行緒合併寫入
+        self._lock = threading.RLock()
+        self._dirty = threading.Event()
+        # 序列化及寫檔只持有此鎖，不阻塞 _lock 上的讀寫 (取鎖順序: _save_lock -> _lock)
+        self._save_lock = threading.RLock()
+        self._flush_thread: Optional[threading.Thread] = None
+        
+        # 持倉列表快取 (數據變更時失效)
+        self._open_view_cache: Optional[List[dict]] = None
+        
+        # 已平倉訂單的 JSON 編碼快取 (只在有訂單平倉或過期時失效)
+        self._closed_json: Optional[bytes] = None
+        
+        # 上次過期檢查時間 (time.monotonic)
+        self._last_expiry_check = float('-inf')
+        
+        # 最近一次載入/保存時數據文件的修改時間 (st_mtime_ns)
+        self._data_mtime: Optional[int] = None
+        
+        # 數據變更時的回調 (例如清除網頁快取)
+        self.on_change: Optional[Callable[[], None]] = None
+        
         # 載入現有數據
         self.load_data()
         
@@ -155,41 +236,94 @@ class TradingTracker:
         過期時間: 美國時間到期日 16:00 (收盤後)
         返回: 過期的訂單數量
         """
-        now_us = self.get_current_us_time()
-        expired_count = 0
+        now = time.monotonic()
+        if now - self._last_expiry_check < self.EXPIRY_CHECK_INTERVAL:
+            return 0
+        self._last_expiry_check = now
         
-        for key, order in list(self.open_positions.items()):
-            if order.status != OrderStatus.OPEN:
-                continue
-            
-            # 解析到期日
-            exp_date = self.parse_expiration_date(order.expiration)
-            if not exp_date:
-                continue
-            
-            # 獲取美國市場收盤時間
-            market_close = self.get_us_market_close_time(exp_date)
+        with self._lock:
+            now_us = self.get_current_us_time()
+            expired_count = 0
             
-            # 如果當前美國時間超過收盤時間，訂單過期
-            if now_us >= market_close:
-                # 過期訂單視為虧損 -100%
-                order.status = OrderStatus.EXPIRED
-                order.exit_time = now_us.astimezone(MACAU_TZ).isoformat()
-                order.pnl_percent = -100
-                order.notes = f"過期自動平倉 (美國市場收盤)"
+            for key, order in list(self.open_positions.items()):
+                if order.status is not OrderStatus.OPEN:
+                    continue
                 
-                # 從持倉中移除
-                del self.open_positions[key]
-                expired_count += 1
+                # 解析到期日
+                exp_date = self.parse_expiration_date(order.expiration)
+                if not exp_date:
+                    continue
                 
-                print(f"📅 訂單過期: {order.ticker} ${order.strike_price}{order.option_type} (到期日: {order.expiration})")
-        
-        # 保存數據
-        if expired_count > 0:
-            self.save_data()
+                # 獲取美國市場收盤時間
+                market_close = self.get_us_market_close_time(exp_date)
+                
+                # 如果當前美國時間超過收盤時間，訂單過期
+                if now_us >= market_close:
+                    # 過期訂單視為虧損 -100%
+                    order.status = OrderStatus.EXPIRED
+                    order.exit_time = now_us.astimezone(MACAU_TZ).isoformat()
+                    order.pnl_percent = -100
+                    order.notes = f"過期自動平倉 (美國市場收盤)"
+                    
+                    # 從持倉中移除
+                    del self.open_positions[key]
+                    self._expired_orders[order.order_id] = order
+                    self._closed_json = None
+                    expired_count += 1
+                    
+                    print(f"📅 訂單過期: {order.ticker} ${order.strike_price}{order.option_type} (到期日: {order.expiration})")
+            
+            # 標記待保存
+            if expired_count > 0:
+                self._mark_dirty()
         
         return expired_count
     
+    def _close_position(self, key: str, order: TradeOrder):
+        """將已平倉訂單移出持倉"""
+        del self.open_positions[key]
+        self._closed_orders[order.order_id] = order
+        self._closed_json = None
+        self._count_result(order)
+    
+    def _count_result(self, order: TradeOrder, delta: int = 1):
+        """按已平倉訂單的盈虧更新勝負計數 (delta=-1 撤銷已計入的結果)"""
+        if order.pnl_percent:
+            if order.pnl_percent > 0:
+                self._wins += delta
+            else:
+                self._losses += delta
+    
+    def _register_order(self, order: TradeOrder, order_id: str = None):
+        """記錄訂單並更新股票代碼索引"""
+        oid = order_id or order.order_id
+        replaced = self.orders.get(oid)
+        if replaced is not None and replaced is not order:
+            # 同一秒內重開同一合約會產生相同ID，舊訂單不再存在於 orders，需移出分區
+            if self._closed_orders.pop(oid, None) is not None:
+                self._count_result(replaced, -1)
+                self._closed_json = None
+            elif self._expired_orders.pop(oid, None) is not None:
+                self._closed_json = None
+        self.orders[oid] = order
+        self._orders_by_ticker.setdefault((order.ticker or '').upper(), {})[oid] = order
+    
+    def _index_message(self, msg: ChannelMessage):
+        """將訊息加入頻道及訂單索引 (各列表保持時間戳升序)"""
+        bisect.insort(self._messages_by_channel.setdefault(msg.channel_id, []), msg, key=_message_sort_key)
+        if msg.has_order:
+            bisect.insort(self._messages_with_order, msg, key=_message_sort_key)
+        else:
+            bisect.insort(self._messages_without_order, msg, key=_message_sort_key)
+    
+    def _rebuild_message_indexes(self):
+        """依 all_messages 重建訊息索引"""
+        self._messages_by_channel = {}
+        self._messages_with_order = []
+        self._messages_without_order = []
+        for msg in self.all_messages:
+            self._index_message(msg)
+    
     def add_message(self, content: str, channel_id: str, message_id: str = "", timestamp: str = "", embeds: List[Dict] = None) -> List[str]:
         """
         添加一條訊息 - 返回關聯的訂單ID列表
@@ -199,34 +333,48 @@ class TradingTracker:
         # 生成消息 ID
         msg_id = message_id or datetime.now().strftime("%Y%m%d%H%M%S%f")
         
-        # 🔧 去重檢查：如果消息已存在，跳過
-        for existing_msg in self.all_messages:
-            if existing_msg.id == msg_id:
-                # 消息已存在，不重複添加
-                return []
-        
-        # 記錄訊息
-        msg = ChannelMessage()
-        msg.id = msg_id
-        msg.channel_id = channel_id
-        msg.content = content
-        msg.timestamp = timestamp or datetime.now(MACAU_TZ).isoformat()
-        
-        # 解析訊息中的訂單信息（支援嵌入格式）
-        order_ids = self._parse_and_update_orders(content, channel_id, msg, embeds)
-        
-        # 標記訊息是否包含訂單
-        msg.has_order = len(order_ids) > 0
-        for oid in order_ids:
-            msg.order_id = oid
-        
-        self.all_messages.append(msg)
-        
-        # 只有當有新消息時才保存
-        self.save_data()
+        with self._lock:
+            # 🔧 去重檢查：如果消息已存在，跳過
+            for existing_msg in self.all_messages:
+                if existing_msg.id == msg_id:
+                    # 消息已存在，不重複添加
+                    return []
+            
+            # 記錄訊息
+            msg = ChannelMessage()
+            msg.id = msg_id
+            msg.channel_id = channel_id
+            msg.content = content
+            msg.timestamp = timestamp or datetime.now(MACAU_TZ).isoformat()
+            
+            try:
+                # 解析訊息中的訂單信息（支援嵌入格式）
+                order_ids = self._parse_and_update_orders(content, channel_id, msg, embeds)
+                
+                # 標記訊息是否包含訂單
+                msg.has_order = len(order_ids) > 0
+                for oid in order_ids:
+                    msg.order_id = oid
+                
+                bisect.insort(self.all_messages, msg, key=_message_sort_key)
+                self._index_message(msg)
+            finally:
+                # 只有當有新消息時才標記待保存；解析中途失敗時已修改的訂單同樣需要保存
+                self._mark_dirty()
         
         return order_ids
     
+    def add_messages_bulk(self, messages: Iterable[Dict]) -> List[str]:
+        """
+        批量添加訊息 - 只取得一次鎖
+        每個元素為 add_message 的關鍵字參數，返回所有新建立的訂單ID
+        """
+        order_ids = []
+        with self._lock:
+            for kwargs in messages:
+                order_ids.extend(self.add_message(**kwargs))
+        return order_ids
+    
     def _parse_and_update_orders(self, content: str, channel_id: str, msg: ChannelMessage, embeds: List[Dict] = None) -> List[str]:
         """解析訊息並更新訂單（支援 Discord Embed 格式）"""
         order_ids = []
@@ -286,19 +434,20 @@ class TradingTracker:
                     notes = notes + " | 🎰 彩票 (高風險)"
                 
                 # 創建訂單
+                now = datetime.now(MACAU_TZ)
                 order = TradeOrder()
-                order.order_id = f"{ticker}_{strike}{opt_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                order.order_id = f"{ticker}_{strike}{opt_type}_{_compact_timestamp(now)}"
                 order.ticker = ticker
                 order.strike_price = strike
                 order.option_type = opt_type
                 order.expiration = expiry
                 order.entry_price = premium
-                order.entry_time = datetime.now(MACAU_TZ).isoformat()
+                order.entry_time = now.isoformat()
                 order.status = OrderStatus.OPEN
                 order.notes = notes
                 order.messages.append(msg.to_dict())
                 
-                self.orders[order.order_id] = order
+                self._register_order(order)
                 self.open_positions[f"{ticker}{strike}{opt_type}"] = order
                 order_ids.append(order.order_id)
                 
@@ -369,19 +518,20 @@ class TradingTracker:
                         notes = (notes + " | 🎰 彩票" if 'notes' in dir() and notes else "🎰 彩票 (高風險)")
                     
                     # 創建新訂單
+                    now = datetime.now(MACAU_TZ)
                     order = TradeOrder()
-                    order.order_id = f"{ticker}_{strike}{opt_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                    order.order_id = f"{ticker}_{strike}{opt_type}_{_compact_timestamp(now)}"
                     order.ticker = ticker
                     order.strike_price = strike
                     order.option_type = opt_type
                     order.expiration = expiry
                     order.entry_price = premium
-                    order.entry_time = datetime.now(MACAU_TZ).isoformat()
+                    order.entry_time = now.isoformat()
                     order.status = OrderStatus.OPEN
                     order.notes = notes if 'notes' in dir() else "買入開倉 (OCULUS)"
                     order.messages.append(msg.to_dict())
                     
-                    self.orders[order.order_id] = order
+                    self._register_order(order)
                     self.open_positions[f"{ticker}{strike}{opt_type}"] = order
                     order_ids.append(order.order_id)
                     
@@ -434,14 +584,16 @@ class TradingTracker:
                 notes = note_text
                 
                 # 提取獲利百分比 (+15%, +25%)
-                pnl_match = re.search(r'\(([+-]?\d+)\s*%?\)', note_text)
-                if pnl_match:
-                    pnl_percent = float(pnl_match.group(1))
+                if '(' in note_text:
+                    pnl_match = _JPM_PNL_RE.search(note_text)
+                    if pnl_match:
+                        pnl_percent = float(pnl_match.group(1))
                 
                 # 提取 close 價格 (all out @.81)
-                close_match = re.search(r'all out\s*@?\$?([\d.]+)', note_text, re.IGNORECASE)
-                if close_match:
-                    exit_price = float(close_match.group(1))
+                if 'all out' in note_text.lower():
+                    close_match = _CLOSE_RE.search(note_text)
+                    if close_match:
+                        exit_price = float(close_match.group(1))
             
             # 查找現有持倉
             position_key = f"{ticker}{strike}{opt_type}"
@@ -465,10 +617,12 @@ class TradingTracker:
                 existing_order.messages.append(msg.to_dict())
                 
                 # 移出持倉
-                del self.open_positions[position_key]
+                self._close_position(position_key, existing_order)
                 order_ids.append(existing_order.order_id)
                 
-                print(f"[JPM] 平倉訂單: {ticker} {strike}{opt_type} @ {exit_price} ({pnl_percent:+.1f}%)")
+                pnl = existing_order.pnl_percent
+                pnl_str = f"{pnl:+.1f}%" if pnl is not None else "N/A"
+                print(f"[JPM] 平倉訂單: {ticker} {strike}{opt_type} @ {exit_price} ({pnl_str})")
                 
                 return order_ids
             elif existing_order:
@@ -480,24 +634,26 @@ class TradingTracker:
                 existing_order.notes = f"更新 {notes}".strip() if notes else "JPM 更新"
                 existing_order.messages.append(msg.to_dict())
                 
-                print(f"[JPM] 更新持倉: {ticker} {strike}{opt_type} @ {entry_price} ({pnl_percent:+.1f}%)")
+                pnl_str = f"{pnl_percent:+.1f}%" if pnl_percent is not None else "N/A"
+                print(f"[JPM] 更新持倉: {ticker} {strike}{opt_type} @ {entry_price} ({pnl_str})")
                 
                 return order_ids
             elif entry_price and not is_close:
                 # 新建持倉 (Open)
+                now = datetime.now(MACAU_TZ)
                 order = TradeOrder()
-                order.order_id = f"{ticker}_{strike}{opt_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                order.order_id = f"{ticker}_{strike}{opt_type}_{_compact_timestamp(now)}"
                 order.ticker = ticker
                 order.strike_price = strike
                 order.option_type = opt_type
                 order.expiration = expiration
                 order.entry_price = entry_price
-                order.entry_time = datetime.now(MACAU_TZ).isoformat()
+                order.entry_time = now.isoformat()
                 order.status = OrderStatus.OPEN
                 order.notes = f"買入開倉 (JPM) {notes}".strip()
                 order.messages.append(msg.to_dict())
                 
-                self.orders[order.order_id] = order
+                self._register_order(order)
                 self.open_positions[position_key] = order
                 order_ids.append(order.order_id)
                 
@@ -519,19 +675,20 @@ class TradingTracker:
             premium = float(bto_match.group(5))
             
             # 創建新訂單
+            now = datetime.now(MACAU_TZ)
             order = TradeOrder()
-            order.order_id = f"{ticker}_{strike}{opt_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            order.order_id = f"{ticker}_{strike}{opt_type}_{_compact_timestamp(now)}"
             order.ticker = ticker
             order.strike_price = strike
             order.option_type = opt_type
             order.expiration = expiration
             order.entry_price = premium
-            order.entry_time = datetime.now(MACAU_TZ).isoformat()
+            order.entry_time = now.isoformat()
             order.status = OrderStatus.OPEN
             order.notes = "買入開倉 (BTO)"
             order.messages.append(msg.to_dict())
             
-            self.orders[order.order_id] = order
+            self._register_order(order)
             self.open_positions[f"{ticker}{strike}{opt_type}"] = order
             order_ids.append(order.order_id)
             
@@ -562,7 +719,7 @@ class TradingTracker:
                 order.messages.append(msg.to_dict())
                 
                 # 從持倉中移除
-                del self.open_positions[key]
+                self._close_position(key, order)
                 order_ids.append(order.order_id)
             
             return order_ids
@@ -586,7 +743,7 @@ class TradingTracker:
                     order.notes = f"止盈通知 PnL: +{pnl}%"
                     order.messages.append(msg.to_dict())
                     
-                    del self.open_positions[key]
+                    self._close_position(key, order)
                     order_ids.append(order.order_id)
                     break
             
@@ -610,7 +767,7 @@ class TradingTracker:
                     order.notes = "止損通知"
                     order.messages.append(msg.to_dict())
                     
-                    del self.open_positions[key]
+                    self._close_position(key, order)
                     order_ids.append(order.order_id)
                     break
             
@@ -641,7 +798,7 @@ class TradingTracker:
             is_close = 'close' in lower_content or 'all out' in lower_content
             
             # 解析盈虧百分比
-            pnl_match = re.search(r'([+-]?\d+)\s*%', notes)
+            pnl_match = _NOTES_PNL_RE.search(notes) if '%' in notes else None
             pnl_percent = float(pnl_match.group(1)) if pnl_match else None
             
             if is_close:
@@ -656,7 +813,7 @@ class TradingTracker:
                     order.notes = f"賣出平倉 (JPM) @ ${price}" if price else "賣出平倉 (JPM)"
                     order.messages.append(msg.to_dict())
                     
-                    del self.open_positions[key]
+                    self._close_position(key, order)
                     order_ids.append(order.order_id)
                     
                     print(f"[JPM] 平倉訂單: {ticker} {strike}{opt_type} @ ${price}")
@@ -664,19 +821,20 @@ class TradingTracker:
                 return order_ids
             else:
                 # 買入開倉
+                now = datetime.now(MACAU_TZ)
                 order = TradeOrder()
-                order.order_id = f"{ticker}_{strike}{opt_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                order.order_id = f"{ticker}_{strike}{opt_type}_{_compact_timestamp(now)}"
                 order.ticker = ticker
                 order.strike_price = strike
                 order.option_type = opt_type
                 order.expiration = f"{exp_month}/{exp_day}"
                 order.entry_price = price
-                order.entry_time = datetime.now(MACAU_TZ).isoformat()
+                order.entry_time = now.isoformat()
                 order.status = OrderStatus.OPEN
                 order.notes = f"買入開倉 (JPM) | {notes}" if notes else "買入開倉 (JPM)"
                 order.messages.append(msg.to_dict())
                 
-                self.orders[order.order_id] = order
+                self._register_order(order)
                 self.open_positions[f"{ticker}{strike}{opt_type}"] = order
                 order_ids.append(order.order_id)
                 
@@ -758,13 +916,14 @@ class TradingTracker:
                     # 從括號中解析 PnL 和 close 價格
                     if notes:
                         # 解析 PnL (+15%, +25%, +60%)
-                        pnl_match = re.search(r'\(([+\-]?\d+)%\)', notes)
-                        if pnl_match:
-                            pnl_percent = float(pnl_match.group(1))
+                        if '(' in notes and '%' in notes:
+                            pnl_match = _EMBED_PNL_RE.search(notes)
+                            if pnl_match:
+                                pnl_percent = float(pnl_match.group(1))
                         
                         # 解析 close 價格 (all out @.81)
-                        if action_type == 'close':
-                            close_match = re.search(r'all out\s*@?\$?([\d.]+)', notes, re.IGNORECASE)
+                        if action_type == 'close' and 'all out' in notes.lower():
+                            close_match = _CLOSE_RE.search(notes)
                             if close_match:
                                 exit_price = float(close_match.group(1))
                     
@@ -792,7 +951,7 @@ class TradingTracker:
                         existing_order.notes = f"JPM 平倉 {notes}".strip() if notes else "JPM 平倉"
                         existing_order.messages.append(msg.to_dict())
                         
-                        del self.open_positions[position_key]
+                        self._close_position(position_key, existing_order)
                         order_ids.append(existing_order.order_id)
                         
                         pnl_str = f"{pnl_percent:+.1f}%" if pnl_percent is not None else "N/A"
@@ -811,19 +970,20 @@ class TradingTracker:
                         
                     elif entry_price:
                         # 新建持倉 (Open)
+                        now = datetime.now(MACAU_TZ)
                         order = TradeOrder()
-                        order.order_id = f"{ticker}_{strike}{opt_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                        order.order_id = f"{ticker}_{strike}{opt_type}_{_compact_timestamp(now)}"
                         order.ticker = ticker
                         order.strike_price = strike
                         order.option_type = opt_type
                         order.expiration = expiration
                         order.entry_price = entry_price
-                        order.entry_time = datetime.now(MACAU_TZ).isoformat()
+                        order.entry_time = now.isoformat()
                         order.status = OrderStatus.OPEN
                         order.notes = f"JPM 買入開倉 {notes}".strip() if notes else "JPM 買入開倉"
                         order.messages.append(msg.to_dict())
                         
-                        self.orders[order.order_id] = order
+                        self._register_order(order)
                         self.open_positions[position_key] = order
                         order_ids.append(order.order_id)
                         
@@ -834,7 +994,6 @@ class TradingTracker:
                     
         except Exception as e:
             print(f"[ERROR] 解析 Embed 失敗: {e}")
-            import traceback
             traceback.print_exc()
         
         return order_ids
@@ -844,7 +1003,8 @@ class TradingTracker:
         # 先檢查過期
         self.check_expired_orders()
         
-        orders = list(self.orders.values())
+        with self._lock:
+            orders = list(self.orders.values())
         orders.sort(key=lambda x: x.entry_time or "", reverse=True)
         return [o.to_dict() for o in orders]
     
@@ -853,142 +1013,396 @@ class TradingTracker:
         # 先檢查過期
         self.check_expired_orders()
         
-        return [o.to_dict() for o in self.open_positions.values()]
+        with self._lock:
+            if self._open_view_cache is None:
+                self._open_view_cache = [o.to_dict() for o in self.open_positions.values()]
+            return list(self._open_view_cache)
     
     def get_closed_orders(self) -> List[dict]:
         """獲取已平倉訂單 (包括過期)"""
         # 先檢查過期
         self.check_expired_orders()
         
-        closed = [o for o in self.orders.values() if o.status in [OrderStatus.CLOSED, OrderStatus.EXPIRED]]
+        with self._lock:
+            closed = list(self._closed_orders.values()) + list(self._expired_orders.values())
         closed.sort(key=lambda x: x.exit_time or "", reverse=True)
         return [o.to_dict() for o in closed]
     
+    def get_closed_orders_json(self) -> bytes:
+        """獲取已平倉訂單的 JSON 編碼 (已平倉訂單不再變動，編碼結果可重用)"""
+        # 先檢查過期
+        self.check_expired_orders()
+        
+        with self._lock:
+            if self._closed_json is None:
+                # 與網頁 JSON provider 相同的選項，嵌入回應後鍵的順序一致
+                self._closed_json = orjson.dumps(
+                    self.get_closed_orders(), option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+                )
+            return self._closed_json
+    
     def get_all_messages(self) -> List[dict]:
-        """獲取所有訊息"""
-        return [m.to_dict() for m in self.all_messages]
+        """獲取所有訊息 (按時間倒序)"""
+        with self._lock:
+            return [m.to_dict() for m in reversed(self.all_messages)]
+    
+    def iter_orders(self) -> Iterator[dict]:
+        """逐筆產生所有訂單 (順序同 get_all_orders)，用於串流導出，不一次建立全部字典"""
+        self.check_expired_orders()
+        
+        with self._lock:
+            orders = list(self.orders.values())
+        orders.sort(key=lambda x: x.entry_time or "", reverse=True)
+        for order in orders:
+            # 訂單可能仍被更新，轉換時短暫取鎖以取得一致的內容
+            with self._lock:
+                data = order.to_dict()
+            yield data
+    
+    def iter_messages(self) -> Iterator[dict]:
+        """逐筆產生所有訊息 (按時間倒序)，用於串流導出"""
+        with self._lock:
+            messages = self.all_messages[::-1]
+        for msg in messages:
+            yield msg.to_dict()
+    
+    def get_orders(self, status: str = None, ticker: str = None) -> List[dict]:
+        """按狀態 (open / closed) 及股票代碼查詢訂單"""
+        if not ticker:
+            if status == 'open':
+                return self.get_open_orders()
+            if status == 'closed':
+                return self.get_closed_orders()
+            return self.get_all_orders()
+        
+        # 先檢查過期
+        self.check_expired_orders()
+        
+        with self._lock:
+            orders = list(self._orders_by_ticker.get(ticker.upper(), {}).values())
+            if status == 'open':
+                open_ids = {id(o) for o in self.open_positions.values()}
+        
+        # 與對應的 get_*_orders 保持相同的篩選及排序
+        if status == 'open':
+            return [o.to_dict() for o in orders if id(o) in open_ids]
+        if status == 'closed':
+            orders = [o for o in orders if o.status is OrderStatus.CLOSED or o.status is OrderStatus.EXPIRED]
+            orders.sort(key=lambda x: x.exit_time or "", reverse=True)
+        else:
+            orders.sort(key=lambda x: x.entry_time or "", reverse=True)
+        return [o.to_dict() for o in orders]
+    
+    def get_latest_message(self) -> Tuple[Optional[dict], int]:
+        """獲取最新訊息及訊息總數 (訊息按時間升序保存，最新一條在末尾)"""
+        with self._lock:
+            if not self.all_messages:
+                return None, 0
+            return self.all_messages[-1].to_dict(), len(self.all_messages)
+    
+    def _select_messages(self, channel_id: str = None, has_order: bool = None) -> List[ChannelMessage]:
+        """從索引選出符合條件的訊息 (時間戳升序，需持有鎖)"""
+        if has_order is None:
+            messages = self.all_messages
+        elif has_order:
+            messages = self._messages_with_order
+        else:
+            messages = self._messages_without_order
+        
+        if channel_id:
+            by_channel = self._messages_by_channel.get(channel_id, [])
+            if has_order is None:
+                messages = by_channel
+            elif len(by_channel) < len(messages):
+                messages = [m for m in by_channel if m.has_order == has_order]
+            else:
+                messages = [m for m in messages if m.channel_id == channel_id]
+        return messages
+    
+    def get_messages(self, channel_id: str = None, has_order: bool = None) -> List[dict]:
+        """按頻道及是否含訂單查詢訊息 (按時間倒序)"""
+        with self._lock:
+            messages = self._select_messages(channel_id, has_order)
+            return [m.to_dict() for m in reversed(messages)]
+    
+    def get_messages_page(self, channel_id: str = None, has_order: bool = None,
+                          offset: int = 0, limit: int = None) -> Tuple[List[dict], int]:
+        """分頁查詢訊息 (按時間倒序)，返回 (該頁訊息, 符合條件的總數)"""
+        with self._lock:
+            messages = self._select_messages(channel_id, has_order)
+            total = len(messages)
+            if limit:
+                # 倒序的 [offset:offset + limit] 對應升序列表的區間
+                end = max(total - offset, 0)
+                page = messages[max(end - limit, 0):end]
+            else:
+                page = messages
+            return [m.to_dict() for m in reversed(page)], total
     
     def get_order_by_id(self, order_id: str) -> Optional[dict]:
         """根據ID獲取訂單"""
-        if order_id in self.orders:
-            return self.orders[order_id].to_dict()
-        return None
+        with self._lock:
+            order = self.orders.get(order_id)
+            return order.to_dict() if order is not None else None
     
     def get_statistics(self) -> dict:
         """簡化統計 - 只顯示訂單數量"""
         # 先檢查過期
         self.check_expired_orders()
         
-        closed = [o for o in self.orders.values() if o.status == OrderStatus.CLOSED]
-        expired = [o for o in self.orders.values() if o.status == OrderStatus.EXPIRED]
-        open_orders = list(self.open_positions.values())
-        
-        wins = len([o for o in closed if o.pnl_percent and o.pnl_percent > 0])
-        losses = len([o for o in closed if o.pnl_percent and o.pnl_percent <= 0])
-        
-        return {
-            "total_orders": len(self.orders),
-            "open_orders": len(open_orders),
-            "closed_orders": len(closed) + len(expired),
-            "expired_orders": len(expired),
-            "wins": wins,
-            "losses": losses,
-            "total_messages": len(self.all_messages)
-        }
+        with self._lock:
+            expired_count = len(self._expired_orders)
+            return {
+                "total_orders": len(self.orders),
+                "open_orders": len(self.open_positions),
+                "closed_orders": len(self._closed_orders) + expired_count,
+                "expired_orders": expired_count,
+                "wins": self._wins,
+                "losses": self._losses,
+                "total_messages": len(self.all_messages)
+            }
+    
+    def _mark_dirty(self):
+        """標記數據已變更，由背景執行緒在 SAVE_DELAY 秒後合併寫入"""
+        self._open_view_cache = None
+        self._dirty.set()
+        self._notify_change()
+        if self._flush_thread is None:
+            with self._lock:
+                if self._flush_thread is None:
+                    self._flush_thread = threading.Thread(
+                        target=self._flush_loop, name='trading-tracker-flush', daemon=True
+                    )
+                    self._flush_thread.start()
+                    # 程式結束前寫入尚未保存的變更
+                    atexit.register(self.flush)
+    
+    def _notify_change(self):
+        """通知數據已變更"""
+        if self.on_change is not None:
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"on_change 回調失敗: {e}")
+    
+    def _flush_loop(self):
+        """背景存檔循環"""
+        while True:
+            self._dirty.wait()
+            time.sleep(self.SAVE_DELAY)
+            self.flush()
+    
+    def flush(self):
+        """立即寫入尚未保存的變更"""
+        # 持有存檔鎖：背景執行緒正在保存時，atexit 的 flush 會等待其完成
+        with self._save_lock:
+            if self._dirty.is_set():
+                self._dirty.clear()
+                self.save_data()
     
     def save_data(self):
         """保存數據"""
         try:
-            data = {
-                "last_updated": datetime.now(MACAU_TZ).isoformat(),
-                "orders": {k: v.to_dict() for k, v in self.orders.items()},
-                "messages": [m.to_dict() for m in self.all_messages]
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with self._save_lock:
+                # 只在 _lock 內建立快照，編碼及寫檔期間不阻塞新訊息與查詢
+                with self._lock:
+                    data = {
+                        "last_updated": datetime.now(MACAU_TZ).isoformat(),
+                        "orders": {k: v.to_dict() for k, v in self.orders.items()},
+                        "messages": [m.to_dict() for m in self.all_messages]
+                    }
+                self._write_atomic(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+                mtime = os.stat(self.data_file).st_mtime_ns
+                with self._lock:
+                    self._data_mtime = mtime
         except Exception as e:
             print(f"保存數據失敗: {e}")
     
+    def _write_atomic(self, payload: bytes):
+        """先寫入同目錄的暫存檔再替換，避免中途中斷或其他進程讀到不完整的文件"""
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.data_file)),
+            prefix=os.path.basename(self.data_file) + '.',
+            suffix='.tmp'
+        )
+        try:
+            # mkstemp 建立的文件權限為 0600，替換前改回原文件 (或新文件預設) 的權限
+            if hasattr(os, 'fchmod'):
+                os.fchmod(fd, self._data_file_mode())
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.data_file)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _data_file_mode(self) -> int:
+        """數據文件應有的權限：沿用現有文件，不存在時按 umask 計算"""
+        try:
+            return stat.S_IMODE(os.stat(self.data_file).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+    
+    def reload_if_changed(self) -> bool:
+        """數據文件被其他進程更新時重新載入，返回是否有重新載入"""
+        try:
+            mtime = os.stat(self.data_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        
+        with self._lock:
+            # 尚有未保存的本地變更時不覆蓋
+            if mtime == self._data_mtime or self._dirty.is_set():
+                return False
+        
+        # 在鎖外解析到全新的結構 (不執行 __init__，只初始化狀態)，現有數據不受影響；
+        # 載入失敗時不記錄修改時間，下次請求會再重試
+        staging = TradingTracker.__new__(TradingTracker)
+        staging.data_file = self.data_file
+        staging._reset_state()
+        staging._data_mtime = None
+        try:
+            if mtime is not None:
+                staging._load_file()
+        except Exception as e:
+            print(f"重新載入數據失敗: {e}")
+            return False
+        
+        with self._lock:
+            # 解析期間產生了本地變更，保留本地數據
+            if self._dirty.is_set():
+                return False
+            for name in self._STATE_ATTRS:
+                setattr(self, name, getattr(staging, name))
+            self._data_mtime = staging._data_mtime
+            self._last_expiry_check = float('-inf')
+        self._notify_change()
+        return True
+    
+    def _reset_state(self):
+        """清空記憶體中的訂單及訊息"""
+        self.orders = {}
+        self.all_messages = []
+        self.open_positions = {}
+        self._closed_orders = {}
+        self._expired_orders = {}
+        self._wins = 0
+        self._losses = 0
+        self._orders_by_ticker = {}
+        self._messages_by_channel = {}
+        self._messages_with_order = []
+        self._messages_without_order = []
+        self._open_view_cache = None
+        self._closed_json = None
+    
     def load_data(self):
         """載入數據"""
         if not os.path.exists(self.data_file):
             return
         
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 重建訂單
-            for oid, odata in data.get('orders', {}).items():
-                order = TradeOrder()
-                order.order_id = odata.get('order_id', '')
-                order.ticker = odata.get('ticker', '')
-                order.option_type = odata.get('option_type', '')
-                order.strike_price = odata.get('strike_price', 0.0)
-                order.expiration = odata.get('expiration', '')
-                order.entry_price = odata.get('entry_price')
-                order.entry_time = odata.get('entry_time')
-                order.exit_price = odata.get('exit_price')
-                order.exit_time = odata.get('exit_time')
-                order.pnl_percent = odata.get('pnl_percent')
-                order.status = OrderStatus(odata.get('status', 'pending'))
-                order.notes = odata.get('notes', '')
-                
-                self.orders[oid] = order
-                
-                # 重建持倉 (只包括 OPEN 狀態)
-                if order.status == OrderStatus.OPEN:
-                    key = f"{order.ticker}{order.strike_price}{order.option_type}"
-                    self.open_positions[key] = order
-            
-            # 🔧 重建訊息並去重
-            seen_ids = set()
-            for mdata in data.get('messages', []):
-                msg_id = mdata.get('id', '')
-                
-                # 去重：只保留第一個相同 ID 的消息
-                if msg_id and msg_id not in seen_ids:
-                    seen_ids.add(msg_id)
-                    msg = ChannelMessage()
-                    msg.id = msg_id
-                    msg.channel_id = mdata.get('channel_id', '')
-                    msg.content = mdata.get('content', '')
-                    msg.timestamp = mdata.get('timestamp', '')
-                    msg.has_order = mdata.get('has_order', False)
-                    msg.order_id = mdata.get('order_id')
-                    
-                    self.all_messages.append(msg)
-                    
+            self._load_file()
         except Exception as e:
             print(f"載入數據失敗: {e}")
     
+    def _load_file(self):
+        """讀取數據文件並重建訂單及訊息 (失敗時拋出例外，成功後才記錄修改時間)"""
+        mtime = os.stat(self.data_file).st_mtime_ns
+        with open(self.data_file, 'rb') as f:
+            data = orjson.loads(f.read())
+        
+        # 重建訂單
+        for oid, odata in data.get('orders', {}).items():
+            order = TradeOrder()
+            order.order_id = odata.get('order_id', '')
+            order.ticker = odata.get('ticker', '')
+            order.option_type = odata.get('option_type', '')
+            order.strike_price = odata.get('strike_price', 0.0)
+            order.expiration = odata.get('expiration', '')
+            order.entry_price = odata.get('entry_price')
+            order.entry_time = odata.get('entry_time')
+            order.exit_price = odata.get('exit_price')
+            order.exit_time = odata.get('exit_time')
+            order.pnl_percent = odata.get('pnl_percent')
+            order.status = OrderStatus(odata.get('status', 'pending'))
+            order.notes = odata.get('notes', '')
+            
+            self._register_order(order, oid)
+            
+            # 重建持倉 (只包括 OPEN 狀態) 及已平倉/已過期分區
+            if order.status is OrderStatus.OPEN:
+                key = f"{order.ticker}{order.strike_price}{order.option_type}"
+                self.open_positions[key] = order
+            elif order.status is OrderStatus.CLOSED:
+                self._closed_orders[oid] = order
+                self._count_result(order)
+            elif order.status is OrderStatus.EXPIRED:
+                self._expired_orders[oid] = order
+        
+        # 🔧 重建訊息並去重
+        seen_ids = set()
+        for mdata in data.get('messages', []):
+            msg_id = mdata.get('id', '')
+            
+            # 去重：只保留第一個相同 ID 的消息
+            if msg_id and msg_id not in seen_ids:
+                seen_ids.add(msg_id)
+                msg = ChannelMessage()
+                msg.id = msg_id
+                msg.channel_id = mdata.get('channel_id', '')
+                msg.content = mdata.get('content', '')
+                msg.timestamp = mdata.get('timestamp') or ''
+                msg.has_order = mdata.get('has_order', False)
+                msg.order_id = mdata.get('order_id')
+                
+                self.all_messages.append(msg)
+        
+        # 舊版文件可能未按時間排序
+        self.all_messages.sort(key=_message_sort_key)
+        self._rebuild_message_indexes()
+        
+        self._data_mtime = mtime
+    
     def clear_all(self):
         """清除所有數據"""
-        self.orders = {}
-        self.all_messages = []
-        self.open_positions = {}
-        if os.path.exists(self.data_file):
-            os.remove(self.data_file)
+        # 先取存檔鎖，避免進行中的保存在刪除後重新寫回舊數據
+        with self._save_lock, self._lock:
+            self._reset_state()
+            # 丟棄尚未寫入的變更
+            self._dirty.clear()
+            if os.path.exists(self.data_file):
+                os.remove(self.data_file)
+            self._data_mtime = None
+        self._notify_change()
     
     def deduplicate(self) -> dict:
         """清理重複數據"""
-        seen_ids = set()
-        unique_messages = []
-        removed_count = 0
-        
-        for msg in self.all_messages:
-            if msg.id not in seen_ids:
-                seen_ids.add(msg.id)
-                unique_messages.append(msg)
-            else:
-                removed_count += 1
-        
-        self.all_messages = unique_messages
-        
-        # 重新保存
-        self.save_data()
-        
-        return {
-            'removed_messages': removed_count,
-            'remaining_messages': len(self.all_messages)
-        }
+        with self._lock:
+            seen_ids = set()
+            unique_messages = []
+            removed_count = 0
+            
+            for msg in self.all_messages:
+                if msg.id not in seen_ids:
+                    seen_ids.add(msg.id)
+                    unique_messages.append(msg)
+                else:
+                    removed_count += 1
+            
+            self.all_messages = unique_messages
+            self._rebuild_message_indexes()
+            
+            # 交由背景執行緒保存，不阻塞呼叫端
+            self._mark_dirty()
+            
+            return {
+                'removed_messages': removed_count,
+                'remaining_messages': len(self.all_messages)
+            }
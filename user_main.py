@@ -12,10 +12,18 @@ Discord 私人頻道內容提取器 - 使用者帳號版本
 import asyncio
 import json
 import os
+import random
+import signal
 import sys
 import threading
 import time
+from dataclasses import dataclass
 from datetime import datetime
+from operator import itemgetter
+from typing import Optional
+
+import aiohttp
+import orjson
 
 # 添加專案根目錄到路徑
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -49,42 +57,210 @@ print("""
 """)
 
 
+# MESSAGE_CREATE 常用欄位，一次取出
+_unpack_msg = itemgetter("channel_id", "id", "content", "author", "timestamp", "embeds")
+_MESSAGE_DEFAULTS = {
+    "channel_id": None,
+    "id": None,
+    "content": "",
+    "author": {},
+    "timestamp": "",
+    "embeds": []
+}
+
+# 尚未收到任何 dispatch 時的心跳內容
+_NULL_HEARTBEAT = '{"op":1,"d":null}'
+
+
+# 模擬 discord.py 訊息物件的輕量結構（供 UserDataHandler 使用）
+@dataclass(slots=True)
+class _FakeChannel:
+    id: Optional[str]
+    name: str
+
+
+@dataclass(slots=True)
+class _FakeAvatar:
+    url: Optional[str]
+
+
+@dataclass(slots=True)
+class _FakeAuthor:
+    name: str
+    id: Optional[str]
+    avatar: _FakeAvatar
+
+
+@dataclass(slots=True)
+class _FakeAttachment:
+    id: Optional[str]
+    filename: Optional[str]
+    url: Optional[str]
+    size: Optional[int]
+    content_type: Optional[str]
+    height: Optional[int]
+    width: Optional[int]
+
+
+@dataclass(slots=True)
+class _FakeMessage:
+    id: Optional[str]
+    channel: _FakeChannel
+    author: _FakeAuthor
+    content: str
+    created_at: datetime
+    edited_at: Optional[datetime]
+    attachments: list
+    embeds: list
+    type: int
+    mentions: list
+    jump_url: str
+
+
+def _flatten_embeds(embeds):
+    """合併 Embed 的標題、描述及欄位 (OCULUS 常見格式) 為純文字"""
+    parts = []
+    for embed in embeds:
+        if isinstance(embed, dict):
+            if embed.get('title'):
+                parts.append(embed['title'])
+            if embed.get('description'):
+                parts.append(embed['description'])
+            if embed.get('fields'):
+                for field in embed['fields']:
+                    if field.get('name') and field.get('value'):
+                        parts.append(f"{field['name']}: {field['value']}")
+    return '\n'.join(parts)
+
+
 class DiscordUserExtractor:
     """使用 Discord WebSocket 監控訊息"""
 
+    __slots__ = (
+        'data_handler', 'trading_tracker', 'channel_ids', '_channel_id_set',
+        'running', 'gateway_url', 'heartbeat_interval', 'session_id',
+        'sequence', 'resume_gateway_url', '_heartbeat_task', '_heartbeat_acked',
+        '_http', '_queue', '_workers', '_dropped_events', '_consecutive_errors',
+        '_identify_payload', '_history_task', '_resuming'
+    )
+
+    # 歷史訊息並行請求數上限
+    HISTORY_FETCH_CONCURRENCY = 3
+
+    # 實時訊息佇列容量及處理 worker 數量
+    EVENT_QUEUE_SIZE = 1024
+    MESSAGE_WORKERS = 4
+
+    # Gateway 關閉碼：無法恢復需重新 IDENTIFY 的，以及重連也無用、應停止的
+    SESSION_RESET_CLOSE_CODES = frozenset({4007, 4009})
+    FATAL_CLOSE_CODES = frozenset({4004, 4010, 4011, 4012, 4013, 4014})
+
     def __init__(self, data_handler, trading_tracker, channel_ids):
         self.data_handler = data_handler
         self.trading_tracker = trading_tracker
         self.channel_ids = [int(cid) for cid in channel_ids]
+        # 字串形式的頻道 ID 集合（Gateway 事件中的 channel_id 為字串）
+        self._channel_id_set = frozenset(str(cid) for cid in self.channel_ids)
         self.running = False
         self.gateway_url = "wss://gateway.discord.gg/?encoding=json&v=9"
         self.heartbeat_interval = None
         self.session_id = None
         self.sequence = None
+        self.resume_gateway_url = None
+        self._heartbeat_task = None
+        self._heartbeat_acked = True
+        self._history_task = None
+        # 正在以 RESUME 恢復 session（收到 RESUMED 前為 True）
+        self._resuming = False
+        self._http = None
+        # Gateway 接收與訊息處理之間的緩衝佇列
+        self._queue = asyncio.Queue(maxsize=self.EVENT_QUEUE_SIZE)
+        self._workers = []
+        self._dropped_events = 0
+        # 連續連線錯誤次數（收到 READY 後歸零）
+        self._consecutive_errors = 0
+        # IDENTIFY 內容固定不變，只序列化一次
+        self._identify_payload = orjson.dumps({
+            "op": 2,
+            "d": {
+                # 識別為用戶
+                "token": USER_TOKEN,
+                "properties": {
+                    "os": "windows",
+                    "browser": "Chrome",
+                    "device": "pc"
+                },
+                "presence": {
+                    "status": "online",
+                    "activities": [],
+                    "since": 0,
+                    "afk": False
+                }
+            }
+        }).decode()
+
+    def _get_http(self):
+        """取得共用的 HTTP session（首次使用時建立）"""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                headers={"Authorization": USER_TOKEN},
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._http
+
+    def _start_workers(self):
+        """啟動訊息處理 worker（已啟動則略過）"""
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._message_worker())
+                for _ in range(self.MESSAGE_WORKERS)
+            ]
+
+    def _stop_workers(self):
+        """停止訊息處理 worker"""
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    async def _message_worker(self):
+        """從佇列取出 MESSAGE_CREATE 事件並處理"""
+        while True:
+            event_data = await self._queue.get()
+            try:
+                await self.on_message(event_data)
+            except Exception as e:
+                print(f"❌ 處理訊息失敗: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def close(self):
+        """停止 worker、關閉 HTTP session 並寫入尚未保存的交易數據"""
+        self._stop_workers()
+        self._cancel_history()
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        # 不依賴 atexit：被信號終止時 atexit 不會執行
+        await asyncio.to_thread(self.trading_tracker.flush)
 
     async def connect(self):
         """連接到 Discord Gateway - 實時監控版本"""
         import websockets
-        import requests
 
         print("正在連接 Discord...")
+        http = self._get_http()
 
         # 驗證 Token 是否有效（先測試 HTTP API）
         try:
-            resp = requests.get(
-                "https://discord.com/api/v9/users/@me",
-                headers={"Authorization": USER_TOKEN},
-                timeout=10
-            )
-            if resp.status_code == 401:
-                print("錯誤：Token 無效或已過期")
-                return False
-            elif resp.status_code == 200:
-                user_data = resp.json()
-                print(f"✓ Token 驗證成功: {user_data['username']}#{user_data['discriminator']}")
-            else:
-                print(f"警告：API 返回狀態碼 {resp.status_code}")
-        except requests.exceptions.Timeout:
+            async with http.get("https://discord.com/api/v9/users/@me") as resp:
+                if resp.status == 401:
+                    print("錯誤：Token 無效或已過期")
+                    return False
+                elif resp.status == 200:
+                    user_data = await resp.json(loads=orjson.loads)
+                    print(f"✓ Token 驗證成功: {user_data['username']}#{user_data['discriminator']}")
+                else:
+                    print(f"警告：API 返回狀態碼 {resp.status}")
+        except asyncio.TimeoutError:
             print("錯誤：網路連線超時，請檢查網路設定")
             return False
         except Exception as e:
@@ -92,15 +268,11 @@ class DiscordUserExtractor:
 
         # 獲取 Gateway URL
         try:
-            resp = requests.get(
-                "https://discord.com/api/v9/gateway",
-                headers={"Authorization": USER_TOKEN},
-                timeout=10
-            )
-            if resp.status_code == 401:
-                print("錯誤：Token 無效或已過期")
-                return False
-            gateway_info = resp.json()
+            async with http.get("https://discord.com/api/v9/gateway") as resp:
+                if resp.status == 401:
+                    print("錯誤：Token 無效或已過期")
+                    return False
+                gateway_info = await resp.json(loads=orjson.loads)
             self.gateway_url = gateway_info["url"] + "/?v=9&encoding=json"
             print(f"Gateway URL: {self.gateway_url}")
         except Exception as e:
@@ -108,72 +280,103 @@ class DiscordUserExtractor:
             return False
 
         # 持續監控直到手動停止
-        consecutive_errors = 0
+        self._consecutive_errors = 0
         max_consecutive_errors = 5
         
-        while consecutive_errors < max_consecutive_errors:
+        while self._consecutive_errors < max_consecutive_errors:
             try:
-                print(f"\n🔄 正在建立 Gateway 連接... (連續錯誤: {consecutive_errors}/{max_consecutive_errors})")
+                print(f"\n🔄 正在建立 Gateway 連接... (連續錯誤: {self._consecutive_errors}/{max_consecutive_errors})")
+                
+                # 有 session 時連到 READY 提供的 resume 地址，以 RESUME 恢復連線
+                if self.session_id and self.resume_gateway_url:
+                    url = self.resume_gateway_url + "/?v=9&encoding=json"
+                    self._resuming = True
+                else:
+                    url = self.gateway_url
+                    self._resuming = False
                 
                 async with websockets.connect(
-                    self.gateway_url,
+                    url,
                     open_timeout=60,
                     close_timeout=10,
                     ping_interval=20,      # 每 20 秒發送 ping
-                    ping_timeout=10        # ping 超時 10 秒
+                    ping_timeout=10,       # ping 超時 10 秒
+                    compression="deflate", # permessage-deflate 壓縮
+                    max_size=8 * 2**20,    # READY 等大型 payload 可達數 MB
+                    read_limit=2**18,
+                    write_limit=2**18
                 ) as websocket:
                     print("✅ Gateway 連接成功 - 開始監控實時訊息")
-                    consecutive_errors = 0
                     self.running = True
                     
-                    # 主循環：接收訊息
-                    while self.running:
-                        try:
-                            message = await asyncio.wait_for(
-                                websocket.recv(),
-                                timeout=30  # 30秒超時
-                            )
-                            await self.handle_message(websocket, message)
-                            
-                        except asyncio.TimeoutError:
-                            # 發送心跳保持連接
-                            await self.send_heartbeat(websocket)
-                            print("💓 Heartbeat 發送 - 連接活躍")
-                            
-                        except websockets.ConnectionClosed as e:
-                            print(f"⚠️ 連接關閉: {e}")
-                            consecutive_errors += 1
-                            break
-                            
-                        except Exception as e:
-                            print(f"⚠️ 接收訊息錯誤: {e}")
-                            consecutive_errors += 1
-                            await asyncio.sleep(2)
-                            break
+                    # 主循環：接收訊息（心跳由獨立的 _heartbeat_loop 發送）
+                    try:
+                        while self.running:
+                            try:
+                                message = await websocket.recv()
+                                await self.handle_message(websocket, message)
+                                
+                            except websockets.ConnectionClosed as e:
+                                print(f"⚠️ 連接關閉: {e}")
+                                self._consecutive_errors += 1
+                                if not self._on_connection_closed(e.code):
+                                    return False
+                                break
+                                
+                            except Exception as e:
+                                print(f"⚠️ 接收訊息錯誤: {e}")
+                                self._consecutive_errors += 1
+                                await asyncio.sleep(2)
+                                break
+                    finally:
+                        self._cancel_heartbeat()
 
             except websockets.ConnectionClosed as e:
                 print(f"❌ Gateway 連接關閉: {e}")
-                consecutive_errors += 1
+                self._consecutive_errors += 1
+                if not self._on_connection_closed(e.code):
+                    return False
                 
             except Exception as e:
                 print(f"❌ Gateway 連接錯誤: {e}")
-                consecutive_errors += 1
+                self._consecutive_errors += 1
+                if self._resuming:
+                    # resume 地址無法連線，改回一般 Gateway 重新 IDENTIFY
+                    self._clear_session()
                 await asyncio.sleep(5)  # 錯誤後等待
                 
             # 重新連接前等待
-            if consecutive_errors < max_consecutive_errors and self.running:
-                wait_time = consecutive_errors * 3
-                print(f"⏳ 等待 {wait_time} 秒後重新連接...")
+            if self._consecutive_errors < max_consecutive_errors and self.running:
+                # 指數退避 + 隨機抖動，避免密集重連觸發限流
+                wait_time = min(60, 2 ** self._consecutive_errors) + random.uniform(0, 1)
+                print(f"⏳ 等待 {wait_time:.1f} 秒後重新連接...")
                 await asyncio.sleep(wait_time)
 
         print("❌ 已達最大連續錯誤次數，停止監控")
         return False
 
+    def _on_connection_closed(self, code):
+        """依關閉碼決定下次如何重連；返回 False 表示應停止監控"""
+        if code in self.FATAL_CLOSE_CODES:
+            print(f"❌ Gateway 關閉碼 {code} 無法透過重連恢復，停止監控")
+            self.running = False
+            return False
+        if code in self.SESSION_RESET_CLOSE_CODES or self._resuming:
+            # session 已失效或 RESUME 未成功，下次改用 IDENTIFY
+            print(f"⚠️ Session 無法恢復 (關閉碼: {code})，將重新驗證")
+            self._clear_session()
+        return True
+
+    def _clear_session(self):
+        """清除 session 資訊，下次連線改用 IDENTIFY"""
+        self.session_id = None
+        self.resume_gateway_url = None
+        self.sequence = None
+        self._resuming = False
+
     async def handle_message(self, websocket, message):
         """處理 Gateway 訊息 - 實時監控增強版"""
-        import json as json_lib
-
-        data = json_lib.loads(message)
+        data = orjson.loads(message)
         op = data.get("op")
 
         if op == 0:  # Dispatch
@@ -186,18 +389,32 @@ class DiscordUserExtractor:
                 
             elif event_type == "MESSAGE_CREATE":
                 channel_id = event_data.get("channel_id")
+                if channel_id not in self._channel_id_set:
+                    return
                 print(f"\n📨 收到新訊息! 頻道: {channel_id}")
-                await self.on_message(event_data)
+                # 交由 worker 處理，不阻塞 Gateway 接收
+                try:
+                    self._queue.put_nowait(event_data)
+                except asyncio.QueueFull:
+                    self._dropped_events += 1
+                    print(f"⚠️ 訊息佇列已滿，已丟棄 {self._dropped_events} 條訊息")
                 
             elif event_type == "MESSAGE_UPDATE":
+                # 同樣只處理監控中的頻道
+                if event_data.get("channel_id") not in self._channel_id_set:
+                    return
                 print(f"✏️ 訊息已編輯: {event_data.get('id')}")
                 await self.on_message_update(event_data)
                 
             elif event_type == "MESSAGE_DELETE":
+                if event_data.get("channel_id") not in self._channel_id_set:
+                    return
                 print(f"🗑️ 訊息已刪除: {event_data.get('id')}")
                 await self.on_message_delete(event_data)
                 
             elif event_type == "RESUMED":
+                self._consecutive_errors = 0
+                self._resuming = False
                 print("✅ 連接已恢復 (Resumed)")
                 
             elif event_type == "INVALID_SESSION":
@@ -207,45 +424,57 @@ class DiscordUserExtractor:
         elif op == 10:  # Hello
             self.heartbeat_interval = data["d"]["heartbeat_interval"] / 1000
             print(f"💓 Heartbeat 間隔: {self.heartbeat_interval:.1f}秒")
-            # 開始身份驗證
-            await self.authenticate(websocket)
+            self._cancel_heartbeat()
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop(websocket))
+            self._start_workers()
+            if self.session_id:
+                # 恢復上次的 session，Discord 只會補發遺漏的事件
+                await self.resume(websocket)
+            else:
+                # 開始身份驗證
+                await self.authenticate(websocket)
 
         elif op == 11:  # Heartbeat ACK
+            self._heartbeat_acked = True
             print("💓 Heartbeat ACK 收到")
 
+        elif op == 1:  # Discord 要求立即發送心跳
+            await self.send_heartbeat(websocket)
+
         elif op == 9:  # Invalid Session
             print("⚠️ 連接被 Discord 拒絕，5秒後重新連接...")
+            if not data.get("d"):
+                # session 無法恢復，重新連接時改用 IDENTIFY
+                self._clear_session()
             self.running = False
 
     async def authenticate(self, websocket):
         """發送身份驗證"""
-        import json
+        await websocket.send(self._identify_payload)
+        print("已發送身份驗證...")
 
-        # 識別為用戶
-        identify_data = {
-            "op": 2,
+    async def resume(self, websocket):
+        """發送 RESUME 恢復 session"""
+        resume_data = {
+            "op": 6,
             "d": {
                 "token": USER_TOKEN,
-                "properties": {
-                    "os": "windows",
-                    "browser": "Chrome",
-                    "device": "pc"
-                },
-                "presence": {
-                    "status": "online",
-                    "activities": [],
-                    "since": 0,
-                    "afk": False
-                }
+                "session_id": self.session_id,
+                "seq": self.sequence
             }
         }
 
-        await websocket.send(json.dumps(identify_data))
-        print("已發送身份驗證...")
+        await websocket.send(orjson.dumps(resume_data).decode())
+        print(f"已發送 RESUME (session: {self.session_id}, seq: {self.sequence})...")
 
     async def on_ready(self, websocket, data):
         """準備就緒 - 開始實時監控"""
         user = data.get('user', {})
+        # 完成握手才視為連線成功
+        self._consecutive_errors = 0
+        # 保存 session 資訊供斷線後 RESUME 使用
+        self.session_id = data.get('session_id')
+        self.resume_gateway_url = data.get('resume_gateway_url')
         print(f"\n{'='*60}")
         print(f"✅ 【Discord 連接成功】")
         print(f"   用戶: {user.get('username')}#{user.get('discriminator')}")
@@ -255,6 +484,12 @@ class DiscordUserExtractor:
             print(f"   - {cid}")
         print(f"{'='*60}")
         
+        # 在背景獲取歷史訊息，接收循環繼續讀取 Heartbeat ACK 等事件
+        self._cancel_history()
+        self._history_task = asyncio.create_task(self._fetch_history(websocket))
+
+    async def _fetch_history(self, websocket):
+        """獲取歷史訊息後提示實時監控已啟動"""
         # 先獲取歷史訊息
         print(f"\n📥 Step 1: 獲取歷史訊息...")
         await self.request_messages(websocket)
@@ -264,74 +499,75 @@ class DiscordUserExtractor:
         print(f"   等待新訊息... (按 Ctrl+C 停止)")
         print(f"{'='*60}\n")
 
-    async def request_messages(self, websocket):
-        """請求頻道歷史訊息 - 使用 REST API"""
-        import json
+    def _cancel_history(self):
+        """停止仍在進行的歷史訊息獲取"""
+        if self._history_task is not None:
+            self._history_task.cancel()
+            self._history_task = None
 
+    async def request_messages(self, websocket):
+        """請求頻道歷史訊息 - 使用 REST API（各頻道並行獲取）"""
         print("\n正在通過 REST API 獲取歷史訊息...")
         
-        for channel_id in self.channel_ids:
-            print(f"\n正在獲取頻道 {channel_id} 的歷史訊息...")
-            success = await self.fetch_channel_messages_via_rest(channel_id)
-            
-            if not success:
+        # 限制同時進行的請求數量，避免觸發 Discord 限流
+        sem = asyncio.Semaphore(self.HISTORY_FETCH_CONCURRENCY)
+        tasks = [
+            asyncio.create_task(self.fetch_channel_messages_via_rest(channel_id, sem))
+            for channel_id in self.channel_ids
+        ]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        for channel_id, success in zip(self.channel_ids, results):
+            if success is not True:
                 print(f"  ⚠️ 頻道 {channel_id} 獲取失敗，可能沒有權限")
-            
-            await asyncio.sleep(0.5)  # 避免請求過快
 
-    async def fetch_channel_messages_via_rest(self, channel_id):
+    async def fetch_channel_messages_via_rest(self, channel_id, sem):
         """通過 REST API 獲取頻道訊息"""
-        import requests
-        import json as json_lib
-        
         url = f"https://discord.com/api/v9/channels/{channel_id}/messages"
-        headers = {"Authorization": USER_TOKEN}
         params = {"limit": 100}
         
         try:
-            resp = requests.get(url, headers=headers, params=params, timeout=10)
+            async with sem:
+                print(f"\n正在獲取頻道 {channel_id} 的歷史訊息...")
+                async with self._get_http().get(url, params=params) as resp:
+                    status = resp.status
+                    messages_data = await resp.json(loads=orjson.loads) if status == 200 else None
+                await asyncio.sleep(0.1)  # 避免請求過快
             
-            if resp.status_code == 200:
-                messages_data = resp.json()
+            if status == 200:
                 if messages_data:
                     print(f"  📥 獲取到 {len(messages_data)} 條歷史訊息")
-                    orders_created = 0
+                    messages_to_save = []
+                    tracker_inputs = []
                     
                     for msg_data in messages_data:
-                        message = self.convert_message_format(msg_data)
-                        await self.data_handler.save_message(message)
+                        messages_to_save.append(self.convert_message_format(msg_data))
                         
                         # 記錄訊息
                         content = msg_data.get('content', '')
                         embeds = msg_data.get('embeds', [])
-                        msg_id = msg_data.get('id', '')
-                        timestamp = msg_data.get('timestamp', '')
                         
                         # 合併嵌入內容
-                        embed_content = ''
-                        for embed in embeds:
-                            if isinstance(embed, dict):
-                                if embed.get('title'):
-                                    embed_content += embed['title'] + '\n'
-                                if embed.get('description'):
-                                    embed_content += embed['description'] + '\n'
-                        
+                        embed_content = _flatten_embeds(embeds)
                         full_content = content + ('\n' + embed_content if embed_content else '')
                         
                         if full_content:
-                            order_ids = self.trading_tracker.add_message(
-                                content=full_content,
-                                channel_id=str(channel_id),
-                                message_id=msg_id,
-                                timestamp=timestamp,
-                                embeds=embeds
-                            )
-                            if order_ids:
-                                orders_created += len(order_ids)
-                                for oid in order_ids:
-                                    order = self.trading_tracker.get_order_by_id(oid)
-                                    if order:
-                                        print(f"    📊 {order['ticker']} | {order['notes']}")
+                            tracker_inputs.append({
+                                'content': full_content,
+                                'channel_id': str(channel_id),
+                                'message_id': msg_data.get('id', ''),
+                                'timestamp': msg_data.get('timestamp', ''),
+                                'embeds': embeds
+                            })
+                    
+                    # 批量寫入，整批只開啟一次檔案、取得一次鎖
+                    await self.data_handler.save_messages_bulk(messages_to_save)
+                    order_ids = self.trading_tracker.add_messages_bulk(tracker_inputs)
+                    orders_created = len(order_ids)
+                    for oid in order_ids:
+                        order = self.trading_tracker.get_order_by_id(oid)
+                        if order:
+                            print(f"    📊 {order['ticker']} | {order['notes']}")
                     
                     if orders_created > 0:
                         print(f"  ✅ 共建立 {orders_created} 筆訂單")
@@ -343,20 +579,20 @@ class DiscordUserExtractor:
                     print(f"  ℹ️ 頻道沒有訊息")
                     return True
                     
-            elif resp.status_code == 403:
+            elif status == 403:
                 print(f"  ❌ 沒有權限訪問此頻道 (403)")
                 return False
                 
-            elif resp.status_code == 404:
+            elif status == 404:
                 print(f"  ❌ 頻道不存在 (404)")
                 return False
                 
-            elif resp.status_code == 429:
+            elif status == 429:
                 print(f"  ⚠️ 被限流了，請稍後重試 (429)")
                 return False
                 
             else:
-                print(f"  ❌ 未知錯誤: {resp.status_code}")
+                print(f"  ❌ 未知錯誤: {status}")
                 return False
                 
         except Exception as e:
@@ -365,14 +601,18 @@ class DiscordUserExtractor:
 
     async def on_message(self, data):
         """收到新訊息 - 實時監控"""
-        channel_id = str(data.get("channel_id"))
-        message_id = data.get("id")
-        content = data.get("content", "")
-        author = data.get("author", {}).get("username", "Unknown")
-        timestamp = data.get("timestamp", "")
+        try:
+            channel_id, message_id, content, author_obj, timestamp, embeds = _unpack_msg(data)
+        except KeyError:
+            # 欄位不齊全時補上預設值
+            channel_id, message_id, content, author_obj, timestamp, embeds = _unpack_msg({**_MESSAGE_DEFAULTS, **data})
+        channel_id = str(channel_id)
+        content = content or ""
+        embeds = embeds or []
+        author = (author_obj or {}).get("username", "Unknown")
         
         # 檢查是否是需要監控的頻道
-        if channel_id not in [str(cid) for cid in self.channel_ids]:
+        if channel_id not in self._channel_id_set:
             return
 
         print(f"\n{'='*60}")
@@ -384,36 +624,16 @@ class DiscordUserExtractor:
         print(f"{'='*60}")
 
         try:
-            content = data.get('content', '')
-            embeds = data.get('embeds', [])
-            
             # 如果有 Embed，則合併 Embed 內容到 content
-            embed_content = ''
-            for embed in embeds:
-                if isinstance(embed, dict):
-                    # 提取 embed title
-                    if embed.get('title'):
-                        embed_content += embed['title'] + '\n'
-                    # 提取 embed description
-                    if embed.get('description'):
-                        embed_content += embed['description'] + '\n'
-                    # 提取 embed fields (OCULUS 常見格式)
-                    if embed.get('fields'):
-                        for field in embed['fields']:
-                            if field.get('name') and field.get('value'):
-                                embed_content += f"{field['name']}: {field['value']}\n"
+            embed_content = _flatten_embeds(embeds)
             
             # 合併 content 和 embed_content
             full_content = content
             if embed_content:
                 full_content = content + '\n' + embed_content
             
-            # 轉換為與 Bot 相容的格式
-            message = self.convert_message_format(data)
-            await self.data_handler.save_message(message)
-            print(f"✅ 訊息已儲存 (ID: {message_id})")
-            
             # 記錄訊息並解析交易訂單
+            # 注意：需在第一個 await 之前完成，多個 worker 並行時才能按接收順序更新持倉
             if full_content:
                 order_ids = self.trading_tracker.add_message(
                     content=full_content,
@@ -444,43 +664,60 @@ class DiscordUserExtractor:
                     # 普通訊息，顯示內容預覽
                     preview = content[:100] + "..." if len(content) > 100 else content
                     print(f"   💬 {preview}")
+        except Exception as e:
+            # 解析失敗不影響下方的 CSV 儲存
+            print(f"❌ 解析交易訊息失敗: {e}")
+
+        try:
+            # 轉換為與 Bot 相容的格式
+            message = self.convert_message_format(data)
+            await self.data_handler.save_message(message)
+            print(f"✅ 訊息已儲存 (ID: {message_id})")
                         
         except Exception as e:
             print(f"❌ 處理訊息失敗: {e}")
 
     def convert_message_format(self, data):
         """轉換為與 discord.py 相容的格式"""
+        # 先取出常用欄位，避免重複的 dict 查找
+        message_id = data.get('id')
+        channel_id = data.get('channel_id')
+        author = data.get('author') or {}
+        author_id = author.get('id')
+        avatar_hash = author.get('avatar')
+        timestamp = data.get('timestamp')
+        edited_timestamp = data.get('edited_timestamp')
+
+        avatar_url = None
+        if avatar_hash:
+            avatar_url = f"https://cdn.discordapp.com/avatars/{author_id}/{avatar_hash}.png"
+
         # 模擬 discord.py 的訊息物件結構
-        return type('Message', (), {
-            'id': data.get('id'),
-            'channel': type('Channel', (), {
-                'id': data.get('channel_id'),
-                'name': 'unknown'
-            })(),
-            'author': type('Author', (), {
-                'name': data.get('author', {}).get('username', 'Unknown'),
-                'id': data.get('author', {}).get('id'),
-                'avatar': type('Avatar', (), {
-                    'url': f"https://cdn.discordapp.com/avatars/{data.get('author', {}).get('id')}/{data.get('author', {}).get('avatar')}.png" if data.get('author', {}).get('avatar') else None
-                })()
-            })(),
-            'content': data.get('content', ''),
-            'created_at': datetime.fromisoformat(data.get('timestamp').replace('Z', '+00:00')) if data.get('timestamp') else datetime.now(),
-            'edited_at': datetime.fromisoformat(data.get('edited_timestamp').replace('Z', '+00:00')) if data.get('edited_timestamp') else None,
-            'attachments': [type('Attachment', (), {
-                'id': a.get('id'),
-                'filename': a.get('filename'),
-                'url': a.get('url'),
-                'size': a.get('size'),
-                'content_type': a.get('content_type'),
-                'height': a.get('height'),
-                'width': a.get('width')
-            })() for a in data.get('attachments', [])],
-            'embeds': data.get('embeds', []),
-            'type': data.get('type', 0),
-            'mentions': data.get('mentions', []),
-            'jump_url': f"https://discord.com/channels/@me/{data.get('channel_id')}/{data.get('id')}"
-        })
+        return _FakeMessage(
+            id=message_id,
+            channel=_FakeChannel(id=channel_id, name='unknown'),
+            author=_FakeAuthor(
+                name=author.get('username', 'Unknown'),
+                id=author_id,
+                avatar=_FakeAvatar(url=avatar_url)
+            ),
+            content=data.get('content', ''),
+            created_at=datetime.fromisoformat(timestamp.replace('Z', '+00:00')) if timestamp else datetime.now(),
+            edited_at=datetime.fromisoformat(edited_timestamp.replace('Z', '+00:00')) if edited_timestamp else None,
+            attachments=[_FakeAttachment(
+                id=a.get('id'),
+                filename=a.get('filename'),
+                url=a.get('url'),
+                size=a.get('size'),
+                content_type=a.get('content_type'),
+                height=a.get('height'),
+                width=a.get('width')
+            ) for a in data.get('attachments', [])],
+            embeds=data.get('embeds', []),
+            type=data.get('type', 0),
+            mentions=data.get('mentions', []),
+            jump_url=f"https://discord.com/channels/@me/{channel_id}/{message_id}"
+        )
 
     async def on_message_update(self, data):
         """訊息編輯"""
@@ -490,22 +727,45 @@ class DiscordUserExtractor:
         """訊息刪除"""
         print(f"訊息已刪除: {data.get('id')}")
 
+    async def _heartbeat_loop(self, websocket):
+        """按 HELLO 指定的間隔發送心跳；兩次心跳之間未收到 ACK 則視為殭屍連線"""
+        self._heartbeat_acked = True
+        # 首次心跳加入隨機延遲（Discord 規範）
+        await asyncio.sleep(self.heartbeat_interval * random.random())
+        while True:
+            if not self._heartbeat_acked:
+                print("⚠️ 未收到 Heartbeat ACK，關閉連接並重新連線")
+                # 使用非 1000 的關閉碼，保留 session 以便 RESUME
+                await websocket.close(code=4000)
+                return
+            self._heartbeat_acked = False
+            await self.send_heartbeat(websocket)
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def _cancel_heartbeat(self):
+        """停止心跳任務"""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
     async def send_heartbeat(self, websocket):
         """發送心跳 - 保持連接活躍"""
-        import json
-
-        if self.sequence:
-            heartbeat = {"op": 1, "d": self.sequence}
-            try:
-                await websocket.send(json.dumps(heartbeat))
-                print(f"💓 Heartbeat sent (seq: {self.sequence})")
-            except Exception as e:
-                print(f"❌ Heartbeat 發送失敗: {e}")
+        if self.sequence is None:
+            heartbeat = _NULL_HEARTBEAT
+        else:
+            heartbeat = orjson.dumps({"op": 1, "d": self.sequence}).decode()
+        try:
+            await websocket.send(heartbeat)
+            print(f"💓 Heartbeat sent (seq: {self.sequence})")
+        except Exception as e:
+            print(f"❌ Heartbeat 發送失敗: {e}")
 
     def stop(self):
         """停止監控"""
         print("\n🛑 收到停止訊號，正在關閉監控...")
         self.running = False
+        self._stop_workers()
+        self._cancel_history()
 
 
 def run_flask(extractor):
@@ -513,7 +773,13 @@ def run_flask(extractor):
     from web.app import set_extractor
     set_extractor(extractor)
     print(f"啟動 Flask 網頁伺服器於 http://{WEB_HOST}:{WEB_PORT}")
-    app.run(host=WEB_HOST, port=WEB_PORT, debug=False, use_reloader=False)
+    # 使用 waitress 作為正式 WSGI 伺服器；未安裝時退回 Werkzeug 開發伺服器
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host=WEB_HOST, port=WEB_PORT, debug=False, use_reloader=False)
+        return
+    serve(app, host=WEB_HOST, port=WEB_PORT, threads=4)
 
 
 async def main():
@@ -534,6 +800,10 @@ async def main():
 ╚══════════════════════════════════════════════════════════╝
 """.format(PORT=WEB_PORT))
 
+    # Python 3.12+：可同步完成的協程直接執行，不必排入下一輪事件循環
+    if sys.version_info >= (3, 12):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
     # 檢查 Token
     if not USER_TOKEN or USER_TOKEN == "YOUR_USER_TOKEN_HERE":
         print("\n錯誤：未設置 Discord Token！")
@@ -570,11 +840,20 @@ async def main():
     print(f"🌐 交易儀表板: http://127.0.0.1:5000/trading")
     print(f"📊 API 接口: http://127.0.0.1:5000/api/trading")
 
+    # SIGTERM (例如部署平台停止服務) 時取消主任務，經由 finally 清理並保存數據；Windows 不支援
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+
     # 開始監控
     print(f"\n{'='*60}")
     print("🚀 開始連接 Discord...")
     print("="*60)
-    success = await extractor.connect()
+    try:
+        success = await extractor.connect()
+    finally:
+        await extractor.close()
 
     if not success:
         print("\n連接失敗，請檢查 Token 和網路連線")
@@ -584,12 +863,23 @@ async def main():
 
 def run():
     """運行主程式"""
+    # 有安裝 uvloop 時使用較快的事件循環（Windows 不支援）
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print("\n" + "="*60)
         print("🛑 使用者中斷 - 程式結束")
         print("="*60)
+    except asyncio.CancelledError:
+        print("\n" + "="*60)
+        print("🛑 收到終止信號 - 程式結束")
+        print("="*60)
     except Exception as e:
         print(f"\n錯誤: {e}")
 
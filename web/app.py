@@ -2,18 +2,68 @@
 Flask 網頁伺服器 - Discord 交易追蹤器
 """
 
-from flask import Flask, render_template, jsonify, request, Response
-import json
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
+from flask_compress import Compress
+from jinja2 import FileSystemBytecodeCache
 import os
 import sys
+import threading
+import time
 import traceback
 from datetime import datetime
 
+import orjson
+
 # 添加專案根目錄到路徑
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import WEB_HOST, WEB_PORT
+from bot.trading_tracker import TradingTracker
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """使用 orjson 的 JSON provider，讓所有 jsonify() 都走 orjson"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# 短時間快取較重的唯讀 API；數據變更時整體清除
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 3})
+
+
+def _cacheable(rv):
+    """只快取成功的回應，錯誤 (例如 500) 不應在快取期間重複返回"""
+    # 收到的是視圖的原始返回值，錯誤時為 (response, status) 元組
+    if isinstance(rv, tuple):
+        return len(rv) < 2 or rv[1] == 200
+    return getattr(rv, 'status_code', 200) == 200
+
+
+# 壓縮較大的 JSON 回應
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+# Flask-Compress 會把串流回應整個讀入記憶體再壓縮，串流導出不壓縮
+app.config['COMPRESS_STREAMS'] = False
+Compress(app)
+
+# 正式環境不檢查模板修改時間，並快取編譯後的模板
+# (只設定 jinja_env，debug 模式啟動時 Flask 仍會重新開啟自動重新載入)
+if not app.debug:
+    app.jinja_env.auto_reload = False
+    # 不指定目錄：Jinja 會建立僅限目前使用者 (0700) 並檢查擁有者的快取目錄
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
 
 
 def get_data_handler():
@@ -60,12 +110,21 @@ def index():
 # @app.route('/api/media/<path:filename>')
 
 
+# 健康檢查時間戳 (同一秒內重用已格式化的字串)
+_health_ts_sec = 0
+_health_ts_str = ''
+
 @app.route('/api/health')
 def health_check():
     """健康檢查"""
+    global _health_ts_sec, _health_ts_str
+    sec = int(time.time())
+    if sec != _health_ts_sec:
+        _health_ts_str = datetime.now().isoformat()
+        _health_ts_sec = sec
     return jsonify({
         'status': 'ok',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': _health_ts_str
     })
 
 
@@ -83,24 +142,34 @@ def get_latest_message():
     """取得最新訊息時間戳（用於客戶端檢測新訊息）"""
     try:
         tracker = get_trading_tracker()
-        messages = tracker.get_all_messages()
+        latest, count = tracker.get_latest_message()
         
-        if messages:
+        latest = latest or {}
+        latest_id = latest.get('id', '')
+        
+        # 沒有新訊息時返回 304，客戶端沿用快取內容
+        etag = f'"{latest_id}:{count}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = Response(status=304)
+        elif count:
             # 取得最新訊息
-            latest = messages[0]  # 已經按時間倒序
-            return jsonify({
+            response = jsonify({
                 'has_new': True,
                 'latest_timestamp': latest.get('timestamp', ''),
-                'latest_id': latest.get('id', ''),
-                'count': len(messages)
+                'latest_id': latest_id,
+                'count': count
+            })
+        else:
+            response = jsonify({
+                'has_new': False,
+                'latest_timestamp': '',
+                'latest_id': '',
+                'count': 0
             })
         
-        return jsonify({
-            'has_new': False,
-            'latest_timestamp': '',
-            'latest_id': '',
-            'count': 0
-        })
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -119,13 +188,32 @@ def debug_page():
     return render_template('debug.html')
 
 
+_tracker_lock = threading.Lock()
+
 def get_trading_tracker():
-    """動態導入 TradingTracker 以避免循環引用"""
-    from bot.trading_tracker import TradingTracker
-    return TradingTracker()
+    """取得共用的 TradingTracker"""
+    # 與 Discord 監控同進程時直接使用其追蹤器
+    if _extractor is not None:
+        tracker = _extractor.trading_tracker
+        tracker.on_change = cache.clear
+        return tracker
+    
+    tracker = app.extensions.get('trading_tracker')
+    if tracker is None:
+        with _tracker_lock:
+            tracker = app.extensions.get('trading_tracker')
+            if tracker is None:
+                tracker = TradingTracker()
+                tracker.on_change = cache.clear
+                app.extensions['trading_tracker'] = tracker
+    
+    # 數據文件被其他進程更新時重新載入
+    tracker.reload_if_changed()
+    return tracker
 
 
 @app.route('/api/trading')
+@cache.cached(response_filter=_cacheable)
 def get_trading_data():
     """獲取交易數據"""
     try:
@@ -133,7 +221,8 @@ def get_trading_data():
         return jsonify({
             'orders': tracker.get_all_orders(),
             'open_orders': tracker.get_open_orders(),
-            'closed_orders': tracker.get_closed_orders(),
+            # 已平倉訂單使用追蹤器快取的編碼結果，不必每次重新編碼
+            'closed_orders': orjson.Fragment(tracker.get_closed_orders_json()),
             'statistics': tracker.get_statistics(),
             'messages': tracker.get_all_messages()  # 添加 messages
         })
@@ -142,25 +231,18 @@ def get_trading_data():
 
 
 @app.route('/api/trading/orders')
+@cache.cached(query_string=True, response_filter=_cacheable)
 def get_trading_orders():
     """獲取所有訂單"""
     try:
         tracker = get_trading_tracker()
-        orders = tracker.get_all_orders()
         
-        # 支援篩選
+        # 支援篩選（使用追蹤器索引，不必掃描全部訂單）
         status = request.args.get('status')  # open, closed
         ticker = request.args.get('ticker')
         limit = request.args.get('limit', type=int)
         
-        if status:
-            if status == 'open':
-                orders = tracker.get_open_orders()
-            elif status == 'closed':
-                orders = tracker.get_closed_orders()
-        
-        if ticker:
-            orders = [o for o in orders if o.get('ticker', '').upper() == ticker.upper()]
+        orders = tracker.get_orders(status=status, ticker=ticker)
         
         if limit:
             orders = orders[:limit]
@@ -188,6 +270,7 @@ def get_order_detail(order_id):
 
 
 @app.route('/api/trading/statistics')
+@cache.cached(response_filter=_cacheable)
 def get_trading_statistics():
     """獲取統計數據"""
     try:
@@ -202,27 +285,20 @@ def get_all_messages():
     """獲取所有訊息"""
     try:
         tracker = get_trading_tracker()
-        messages = tracker.get_all_messages()
         
-        # 支援篩選
+        # 支援篩選（使用追蹤器索引，不必掃描全部訊息）
         has_order = request.args.get('has_order')  # true, false
         channel_id = request.args.get('channel_id')
         limit = request.args.get('limit', type=int)
         offset = request.args.get('offset', type=int, default=0)
         
         if has_order is not None:
-            filter_value = has_order.lower() == 'true'
-            messages = [m for m in messages if m.get('has_order') == filter_value]
-        
-        if channel_id:
-            messages = [m for m in messages if m.get('channel_id') == channel_id]
+            has_order = has_order.lower() == 'true'
         
-        # 按時間倒序
-        messages.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        
-        total = len(messages)
-        if limit:
-            messages = messages[offset:offset + limit]
+        # 追蹤器按時間倒序返回，並只轉換該頁的訊息
+        messages, total = tracker.get_messages_page(
+            channel_id=channel_id, has_order=has_order, offset=offset, limit=limit
+        )
         
         return jsonify({
             'messages': messages,
@@ -301,21 +377,27 @@ def debug_trading_data():
 
 @app.route('/api/trading/export')
 def export_trading_data():
-    """導出數據"""
+    """導出數據（NDJSON 串流：首行為 meta，其後每行一筆訂單或訊息）"""
     try:
         tracker = get_trading_tracker()
-        data = {
-            'exported_at': datetime.now().isoformat(),
-            'statistics': tracker.get_statistics(),
-            'orders': tracker.get_all_orders(),
-            'messages': tracker.get_all_messages()
-        }
+        exported_at = datetime.now()
+        
+        def generate():
+            yield orjson.dumps({
+                'type': 'meta',
+                'exported_at': exported_at,  # orjson 直接序列化 datetime
+                'statistics': tracker.get_statistics()
+            }, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+            for order in tracker.iter_orders():
+                yield orjson.dumps({'type': 'order', 'data': order}, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+            for message in tracker.iter_messages():
+                yield orjson.dumps({'type': 'message', 'data': message}, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
         
         return Response(
-            json.dumps(data, ensure_ascii=False, indent=2),
-            mimetype='application/json; charset=utf-8',
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
             headers={
-                'Content-Disposition': f'attachment; filename=trading_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+                'Content-Disposition': f'attachment; filename=trading_export_{exported_at.strftime("%Y%m%d_%H%M%S")}.ndjson'
             }
         )
     except Exception as e:
@@ -339,5 +421,6 @@ def create_app():
     return app
 
 
-#if __name__ == '__main__':
-#    app.run(host=WEB_HOST, port=WEB_PORT, debug=True)
+if __name__ == '__main__':
+    # 僅供本地開發；正式環境請使用 gunicorn wsgi:app
+    app.run(host=WEB_HOST, port=WEB_PORT, debug=os.environ.get('FLASK_ENV') == 'development')
@@ -0,0 +1,14 @@
+"""
+WSGI 入口 - 供 gunicorn 等正式伺服器使用
+
+啟動方式：
+    gunicorn -w 1 -k gthread --threads 8 -b $WEB_HOST:$WEB_PORT wsgi:app
+
+注意：TradingTracker 的狀態保存在進程內並延遲寫入，多個 worker
+同時寫入會互相覆蓋（清除後的數據也可能被其他 worker 寫回），
+因此只能使用單一 worker，以執行緒處理並發請求。
+"""
+
+from web.app import create_app
+
+app = create_app()